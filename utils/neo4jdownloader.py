@@ -1,31 +1,180 @@
 """Neo4JDownloader class for graph downloading from Neo4J."""
 
-from neo4j import GraphDatabase
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from neo4j import GraphDatabase, ManagedTransaction, Transaction, READ_ACCESS
 from neo4j.exceptions import DriverError, Neo4jError
 import logging
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
+
+def _escape(name):
+    # Labels / property names can't be parameters; escape them for backticks
+    return name.replace("`", "``")
+
+
+def _edge_index(srcs, dsts):
+    # (2, E) C-contiguous int64 edge index, the layout PyG / DGL consume
+    # without copying. `srcs` / `dsts` are int64 buffers or arrays.
+    edge_index = np.empty((2, len(srcs)), dtype=np.int64)
+    edge_index[0] = srcs
+    edge_index[1] = dsts
+    assert edge_index.flags["C_CONTIGUOUS"]
+    return edge_index
+
+
+def _edge_csr(srcs, dsts, feats, src_positions, dst_positions):
+    # Sparse adjacency whose rows / columns follow the order of the source /
+    # target label's node ids. scipy is only needed for this output.
+    # Returns the matrix and `feats` reordered so that feats[i] belongs to
+    # stored entry i; parallel edges stay separate entries (not summed).
+    from scipy.sparse import csr_matrix
+
+    n_src, n_dst = len(src_positions), len(dst_positions)
+    rows = np.fromiter((src_positions[s] for s in srcs), dtype=np.int64, count=len(srcs))
+    cols = np.fromiter((dst_positions[d] for d in dsts), dtype=np.int64, count=len(dsts))
+
+    # Row-major order, built by hand because csr_matrix((data, (rows, cols)))
+    # sums duplicates and loses the edge -> attribute alignment
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(n_src + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_src), out=indptr[1:])
+    adjacency = csr_matrix(
+        (np.ones(len(order), dtype=np.int64), cols[order], indptr),
+        shape=(n_src, n_dst),
+    )
+    return adjacency, [feats[i] for i in order]
+
 
 class Neo4JDownloader:
-    def __init__(self, uri, user, password, database=None):
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
+    def __init__(
+        self,
+        uri,
+        user,
+        password,
+        database=None,
+        max_connection_pool_size=100,
+        connection_acquisition_timeout=60.0,
+        connection_timeout=30.0,
+        max_transaction_retry_time=30.0,
+        keep_alive=True,
+        fetch_size=1000,
+    ):
+        # One driver (and so one connection pool) for the downloader's whole
+        # lifetime; the get_* helpers only ever receive transactions from it
+        self.driver = GraphDatabase.driver(
+            uri,
+            auth=(user, password),
+            max_connection_pool_size=max_connection_pool_size,
+            connection_acquisition_timeout=connection_acquisition_timeout,
+            connection_timeout=connection_timeout,
+            max_transaction_retry_time=max_transaction_retry_time,
+            keep_alive=keep_alive,
+            # Records pulled per round-trip; per-call override via `fetch_size`
+            fetch_size=fetch_size,
+        )
         self.database = database
+        # Set while inside `batch()`, shared by all retrieve_* calls
+        self._session = None
+        self._tx = None
 
     def close(self):
         # Don't forget to close the driver connection when you are finished
         # with it
         self.driver.close()
 
-    def get_entire_graph(self, driver):
+    def _new_session(self, fetch_size=None, **config):
+        if fetch_size is not None:
+            config["fetch_size"] = fetch_size
+        return self.driver.session(database=self.database, **config)
+
+    @contextmanager
+    def batch(self, fetch_size=None):
+        """
+        Share one session and one read transaction across every retrieve_*
+        call made inside the block. Nested batches reuse the outer one, so
+        only the outermost fetch_size applies:
+
+            with downloader.batch():
+                ids, feats = downloader.retrieve_nodes(labels)
+                index, attrs = downloader.retrieve_edges(relationships)
+        """
+        if self._tx is not None:
+            # Already batching, reuse the outer transaction
+            self._warn_fetch_size_ignored(fetch_size)
+            yield self
+            return
+        self._session = self._new_session(
+            fetch_size, default_access_mode=READ_ACCESS
+        )
+        try:
+            self._tx = self._session.begin_transaction()
+            try:
+                yield self
+            finally:
+                self._tx.close()
+        finally:
+            self._tx = None
+            self._session.close()
+            self._session = None
+
+    @staticmethod
+    def _warn_fetch_size_ignored(fetch_size):
+        # An open batch keeps the fetch size its session was opened with
+        if fetch_size is not None:
+            logger.warning(
+                "fetch_size=%s ignored inside batch(); set it on the outermost batch() instead",
+                fetch_size,
+            )
+
+    def _read(self, work, *args):
+        # Run `work(tx, *args)` on the batch transaction if there is one,
+        # otherwise in a managed read transaction of a fresh session
+        if self._tx is not None:
+            return work(self._tx, *args)
+        return self._read_in_new_session(work, *args)
+
+    def _read_in_new_session(self, work, *args):
+        # Sessions aren't thread safe, so every worker thread needs its own
+        with self._new_session() as session:
+            return session.execute_read(work, *args)
+
+    def _read_parallel(self, work, args_list, max_workers):
+        # Fan `work` out over the driver pool, one session per call.
+        # Returns results in the order of `args_list`.
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(self._read_in_new_session, work, *args)
+                for args in args_list
+            ]
+            return [future.result() for future in futures]
+
+    @contextmanager
+    def _runner(self, fetch_size=None):
+        # Something with `.run()`: the batch transaction or a fresh session.
+        # `fetch_size` only applies to the fresh session, a batch keeps its own.
+        if self._tx is not None:
+            self._warn_fetch_size_ignored(fetch_size)
+            yield self._tx
+            return
+        with self._new_session(fetch_size) as session:
+            yield session
+
+    def get_entire_graph(self, tx):
+        assert isinstance(tx, (Transaction, ManagedTransaction))
         query = """
         MATCH (s)-[r]->(t)
         RETURN s, r, t
         """
-        results = driver.run(query)
+        results = tx.run(query)
         for record in results:
             print(record)
 
-    def get_nodes(self, driver, label):
+    def get_nodes(self, tx, label):
+        assert isinstance(tx, (Transaction, ManagedTransaction))
         query = """
         CALL apoc.cypher.run(
             'MATCH (n:`' + $label + '`)
@@ -35,183 +184,388 @@ class Neo4JDownloader:
         RETURN value.id, {name: value.name} AS features;
         """
         try:
-            results = driver.run(query, {"label": label})
+            results = tx.run(query, {"label": label})
             ids, features = [], []
             for record in results:
                 ids.append(record["value.id"])
                 features.append(record["features"])
             return ids, features
         except (DriverError, Neo4jError) as exception:
-            logging.error("%s raised an error: \n%s", query, exception)
+            logger.error("%s raised an error: \n%s", query, exception)
             raise
 
-    def get_node_name_by_id(self, driver, node_id):
-        query = f"""
+    def get_nodes_for_labels(self, tx, labels):
+        assert isinstance(tx, (Transaction, ManagedTransaction))
+        # Dedup (keeping order): a repeated label would run its MATCH twice
+        # and collect() would merge both runs into one doubled group
+        labels = list(dict.fromkeys(labels))
+        query = """
+        UNWIND $labels AS label
+        CALL apoc.cypher.run(
+            'MATCH (n:`' + label + '`)
+            RETURN ID(n) AS id, n.name AS name',
+            {}
+        ) YIELD value
+        RETURN label, collect({id: value.id, name: value.name}) AS rows;
+        """
+        try:
+            results = tx.run(query, {"labels": labels})
+            ids = {label: [] for label in labels}
+            features = {label: [] for label in labels}
+            for record in results:
+                rows = record["rows"]
+                ids[record["label"]] = [row["id"] for row in rows]
+                features[record["label"]] = [{"name": row["name"]} for row in rows]
+            return ids, features
+        except (DriverError, Neo4jError) as exception:
+            logger.error("%s raised an error: \n%s", query, exception)
+            raise
+
+    @staticmethod
+    def get_node_name_by_id(tx, node_id):
+        assert isinstance(tx, (Transaction, ManagedTransaction))
+        query = """
         MATCH (n)
-        WHERE ID(n) = {node_id}
+        WHERE ID(n) = $node_id
         RETURN n.name AS name
         """
         try:
-            result = driver.run(query).single()
+            result = tx.run(query, {"node_id": node_id}).single()
             if result:
                 return result["name"]
             else:
                 return None
         except (DriverError, Neo4jError) as exception:
-            logging.error("%s raised an error: \n%s", query, exception)
+            logger.error("%s raised an error: \n%s", query, exception)
+            raise
+
+    @staticmethod
+    def get_nodes_by_ids(tx, node_ids):
+        assert isinstance(tx, (Transaction, ManagedTransaction))
+        query = """
+        UNWIND $node_ids AS node_id
+        MATCH (n)
+        WHERE ID(n) = node_id
+        RETURN ID(n) AS id, labels(n) AS labels, properties(n) AS props
+        """
+        try:
+            results = tx.run(query, {"node_ids": list(node_ids)})
+            return {record["id"]: (record["labels"], record["props"]) for record in results}
+        except (DriverError, Neo4jError) as exception:
+            logger.error("%s raised an error: \n%s", query, exception)
             raise
 
-    def get_edges(self, driver, src_label, rel_type, dst_label):
+    def get_edges(self, tx, src_label, rel_type, dst_label):
+        assert isinstance(tx, (Transaction, ManagedTransaction))
         query = f"""
-        MATCH (a:{src_label})-[r:`{rel_type}`]->(b:{dst_label})
+        MATCH (a:`{_escape(src_label)}`)-[r:`{_escape(rel_type)}`]->(b:`{_escape(dst_label)}`)
         RETURN ID(a) AS src, ID(b) AS dst, r.feat AS edge_features
         """
-        results = driver.run(query)
-        edge_index, edge_attrs = [], []
+        results = tx.run(query)
+        srcs, dsts, edge_attrs = array("q"), array("q"), []
         for record in results:
-            edge_index.append([record["src"], record["dst"]])
+            srcs.append(record["src"])
+            dsts.append(record["dst"])
             edge_attrs.append(record["edge_features"])
-        return np.array(edge_index).T, edge_attrs
-
-    def retrieve_nodes(self, nodes_list):
-        ids = {}
-        feats = {}
-        with self.driver.session(database=self.database) as session:
-            for node in nodes_list:
-                id, feat = session.execute_read(self.get_nodes, node)
-                ids[node] = id
-                feats[node] = feat
-        return ids, feats
-
-    def retrieve_edges(self, relationship_dict):
-        edges_index = {}
-        edges_attributes = {}
-        for key, subdict in relationship_dict.items():
-            edges_index[key] = {}
-            edges_attributes[key] = {}
-            for type, val in subdict.items():
-                with self.driver.session(database=self.database) as session:
-                    source = val["source"]
-                    target = val["target"]
-                    relationship = key
-                    edge_index, edge_attributes = session.execute_read(
-                        self.get_edges, source, relationship, target
+        return _edge_index(srcs, dsts), edge_attrs
+
+    def get_edges_for_specs(self, tx, specs):
+        assert isinstance(tx, (Transaction, ManagedTransaction))
+        query = """
+        UNWIND $specs AS s
+        CALL apoc.cypher.run(
+            'MATCH (a:`' + s.source + '`)-[r:`' + s.rel + '`]->(b:`' + s.target + '`)
+            RETURN ID(a) AS src, ID(b) AS dst, r.feat AS feat',
+            {}
+        ) YIELD value
+        RETURN s.key AS key, s.type AS type, collect(value) AS rows;
+        """
+        # Names are spliced into the inner query text, so escape them the same
+        # way get_edges does; `key` stays raw for grouping the results
+        escaped = [
+            {
+                **spec,
+                "source": _escape(spec["source"]),
+                "rel": _escape(spec["key"]),
+                "target": _escape(spec["target"]),
+            }
+            for spec in specs
+        ]
+        try:
+            results = tx.run(query, {"specs": escaped})
+            grouped = {(spec["key"], spec["type"]): [] for spec in specs}
+            for record in results:
+                grouped[(record["key"], record["type"])] = record["rows"]
+        except (DriverError, Neo4jError) as exception:
+            logger.error("%s raised an error: \n%s", query, exception)
+            raise
+
+        edges_index, edges_attributes = {}, {}
+        for (key, type), rows in grouped.items():
+            edges_index.setdefault(key, {})[type] = _edge_index(
+                np.fromiter((row["src"] for row in rows), dtype=np.int64, count=len(rows)),
+                np.fromiter((row["dst"] for row in rows), dtype=np.int64, count=len(rows)),
+            )
+            edges_attributes.setdefault(key, {})[type] = [row["feat"] for row in rows]
+        return edges_index, edges_attributes
+
+    def ensure_indexes(self, specs):
+        """
+        Create the missing range indexes described by `specs`, a mapping
+        label -> [properties], e.g. {"user": ["name"], "repo": ["name"]}.
+        Run once before retrieve_nodes / retrieve_subgraph so that seed
+        queries filtering on those properties can use an index.
+        """
+        # Schema changes can't run in a read transaction, so this never
+        # joins an open `batch()`
+        with self._new_session() as session:
+            for label, properties in specs.items():
+                for prop in properties:
+                    query = (
+                        "CREATE INDEX IF NOT EXISTS "
+                        f"FOR (n:`{_escape(label)}`) ON (n.`{_escape(prop)}`)"
                     )
-                    edges_index[key][type] = edge_index
-                    edges_attributes[key][type] = edge_attributes
+                    try:
+                        session.run(query).consume()
+                    except (DriverError, Neo4jError) as exception:
+                        logger.error("%s raised an error: \n%s", query, exception)
+                        raise
+
+    def retrieve_nodes(self, nodes_list, max_workers=None):
+        # Read more than once below, so don't let a generator run dry
+        nodes_list = list(nodes_list)
+        # With `max_workers`, query each label concurrently on its own
+        # session; inside `batch()` the shared transaction wins
+        if max_workers and self._tx is None:
+            results = self._read_parallel(
+                self.get_nodes, [(node,) for node in nodes_list], max_workers
+            )
+            ids = {node: id for node, (id, _) in zip(nodes_list, results)}
+            feats = {node: feat for node, (_, feat) in zip(nodes_list, results)}
+            return ids, feats
+        # One round-trip for all labels instead of one query per label
+        return self._read(self.get_nodes_for_labels, nodes_list)
+
+    def retrieve_nodes_by_ids(self, node_ids, chunk_size=10000):
+        # id -> (labels, props), one round-trip per `chunk_size` ids
+        node_ids = list(node_ids)
+        nodes = {}
+        for start in range(0, len(node_ids), chunk_size):
+            chunk = node_ids[start:start + chunk_size]
+            nodes.update(self._read(self.get_nodes_by_ids, chunk))
+        return nodes
+
+    def retrieve_node_names_by_ids(self, node_ids, chunk_size=10000):
+        # id -> name, projected from the same chunked bulk lookup
+        nodes = self.retrieve_nodes_by_ids(node_ids, chunk_size)
+        return {node_id: props.get("name") for node_id, (_, props) in nodes.items()}
+
+    def retrieve_edges(self, relationship_dict, max_workers=None):
+        # Flatten {rel: {type: {source, target}}} so every (rel, type) pair
+        # is fetched in the same round-trip
+        specs = [
+            {"key": key, "type": type, "source": val["source"], "target": val["target"]}
+            for key, subdict in relationship_dict.items()
+            for type, val in subdict.items()
+        ]
+        edges_index = {key: {} for key in relationship_dict}
+        edges_attributes = {key: {} for key in relationship_dict}
+        if not specs:
+            return edges_index, edges_attributes
+        if max_workers and self._tx is None:
+            results = self._read_parallel(
+                self.get_edges,
+                [(spec["source"], spec["key"], spec["target"]) for spec in specs],
+                max_workers,
+            )
+            for spec, (edge_index, edge_attributes) in zip(specs, results):
+                edges_index[spec["key"]][spec["type"]] = edge_index
+                edges_attributes[spec["key"]][spec["type"]] = edge_attributes
+            return edges_index, edges_attributes
+        index, attributes = self._read(self.get_edges_for_specs, specs)
+        edges_index.update(index)
+        edges_attributes.update(attributes)
         return edges_index, edges_attributes
 
     def retrieve_all(self):
-        with self.driver.session(database=self.database) as session:
-            session.execute_read(self.get_entire_graph)
-
-    def retrieve_subgraph(self, relationships, cypher_filter_query, depth):
+        self._read(self.get_entire_graph)
+
+    def retrieve_subgraph(
+        self,
+        relationships,
+        cypher_filter_query,
+        depth,
+        properties_per_label=None,
+        fetch_size=None,
+        as_csr=False,
+    ):
         """
         Extract a subgraph based on:
-            - A Cypher filter query (must return n)
+            - A Cypher filter query (a read-only query that must return n)
             - A depth N expansion 
+        properties_per_label (label -> [properties]) restricts the features
+        stored under each label to that label's properties, dropping the rest
+        server-side; labels not listed get empty features. By default every
+        property is returned under every label.
+        fetch_size overrides how many records are pulled per round-trip:
+        larger means fewer round-trips, smaller bounds client memory.
+        Inside `batch()` the batch's session is reused, so this is ignored
+        (with a warning); pass fetch_size to `batch()` instead.
+        as_csr=True returns each edge index as a scipy.sparse.csr_matrix of
+        shape (len(nodes_ids[source]), len(nodes_ids[target])) instead of a
+        (2, E) array, indexed by position in nodes_ids. Every relationship
+        is its own stored entry (value 1, parallel edges not summed), and
+        edges_attributes[rel][type][i] belongs to stored entry i; calling
+        sum_duplicates() on the matrix breaks that alignment.
         Returns:
             nodes_ids, nodes_features, edges_indices, edges_attributes
         """
-        with self.driver.session(database=self.database) as session:
-            # Step 1: filter query → seed nodes
-            seed_result = session.run(cypher_filter_query)
-            seed_ids = [record["n"].id for record in seed_result]
-
-            if not seed_ids:
-                return {}, {}, {}, {}
-
-            # Step 2: expand subgraph to depth N
-            expand_query = f"""
-            MATCH (start)
-            WHERE id(start) IN $seed_ids
-            MATCH p = (start)-[*1..{depth}]-(other)
-            RETURN p
+        with self._runner(fetch_size) as session:
+            # rel -> [[src_label, dst_label, "type1"], ...], e.g.
+            # relationships["owner_of"]["type1"] -> ["user", "repo", "type1"].
+            # The server matches each relationship against all of them.
+            type_pairs = {
+                rel: [
+                    [info["source"], info["target"], typename]
+                    for typename, info in rel_def.items()
+                ]
+                for rel, rel_def in relationships.items()
+            }
+
+            # The filter query runs as a subquery producing the seeds, then
+            # each seed is expanded to depth N in the same round-trip.
+            # subgraphAll returns every reachable node and relationship once
+            # per seed, instead of once per path through it.
+            filter_query = cypher_filter_query.strip().rstrip(";")
+            expand_query = "CALL {\n" + filter_query + "\n}\n" + """
+            WITH DISTINCT n AS start
+            CALL apoc.path.subgraphAll(start, {
+                maxLevel: $depth,
+                relationshipFilter: $rel_filter
+            })
+            YIELD nodes, relationships
+            RETURN
+                [n IN nodes | {
+                    id: id(n),
+                    labels: labels(n),
+                    features: [l IN labels(n) | CASE
+                        WHEN $node_props IS NULL THEN properties(n)
+                        ELSE apoc.map.fromPairs([
+                            k IN coalesce($node_props[l], []) | [k, n[k]]
+                        ])
+                    END]
+                }] AS nodes,
+                [r IN relationships WHERE type(r) IN $rel_types | {
+                    id: id(r),
+                    src: id(startNode(r)),
+                    dst: id(endNode(r)),
+                    props: properties(r),
+                    type: type(r),
+                    typenames: [
+                        pair IN $type_pairs[type(r)]
+                        WHERE pair[0] IN labels(startNode(r)) AND pair[1] IN labels(endNode(r))
+                        | pair[2]
+                    ]
+                }] AS rels
             """
-            print("Starting expansion and extraction of subgraph...")
-            result = session.run(expand_query, seed_ids=seed_ids)
+            logger.info("Starting expansion and extraction of subgraph...")
+            result = session.run(
+                expand_query,
+                depth=depth,
+                rel_filter="|".join(relationships),
+                rel_types=list(relationships),
+                type_pairs=type_pairs,
+                node_props=properties_per_label,
+            )
 
             nodes_ids = {}          # label -> [ids]
             nodes_features = {}     # label -> [ {props} ]
+            seen_nodes = set()      # node ids already added
+            seen_rels = set()       # relationship ids already grouped
 
-            edges_indices = {}      # rel -> {type_name: np.array([...])}
+            edges_indices = {}      # rel -> {type_name: int64 array (2, E)}
             edges_attributes = {}   # rel -> {type_name: props}
 
-            # Temporary storage for edges
-            tmp_edges = {}  # (rel_type) → [ (src_id, dst_id, props, src_labels, dst_labels) ]
-            paths = list(result)
+            # rel -> {type_name: (srcs, dsts, feats)}, ids kept unboxed as int64
+            grouped = {}
 
-            for record in paths:
-                p = record["p"]
+            # Consume records as they stream in rather than buffering them all.
+            # Seeds can share neighbourhoods, so nodes and relationships are
+            # deduplicated by id before any per-item work.
+            for record in result:
 
                 # --- Nodes ---
-                for n in p.nodes:
-                    for lab in n.labels:
+                for n in record["nodes"]:
+                    n_id = n["id"]
+                    if n_id in seen_nodes:
+                        continue
+                    seen_nodes.add(n_id)
+
+                    # One features map per label, in the order of n["labels"]
+                    for lab, props in zip(n["labels"], n["features"]):
 
                         if lab not in nodes_ids:
                             nodes_ids[lab] = []
                             nodes_features[lab] = []
 
-                        if n.id not in nodes_ids[lab]:
-                            nodes_ids[lab].append(n.id)
-                            nodes_features[lab].append(dict(n))
+                        nodes_ids[lab].append(n_id)
+                        nodes_features[lab].append(props)
 
                 # --- Relationships ---
-                for r in p.relationships:
-                    reltype = r.type
-
-                    if reltype not in tmp_edges:
-                        tmp_edges[reltype] = []
-
-                    tmp_edges[reltype].append((
-                        r.start_node.id,
-                        r.end_node.id,
-                        dict(r),
-                        list(r.start_node.labels),
-                        list(r.end_node.labels)
-                    ))
+                for r in record["rels"]:
+                    if r["id"] in seen_rels:
+                        continue
+                    seen_rels.add(r["id"])
 
-            for reltype, triples in tmp_edges.items():
+                    reltype = r["type"]
 
-                edges_indices[reltype] = {}
-                edges_attributes[reltype] = {}
+                    if reltype not in grouped:
+                        grouped[reltype] = {}
 
-                # Look up allowed types & their expected direction
-                # Example: relationships["owner_of"]["type1"] -> ("user", "repo")
-                rel_def = relationships[reltype] 
+                    # Every declared type whose labels both endpoints carry
+                    for typename in r["typenames"]:
 
-                # Build a mapping:  (src_label, dst_label) -> "type1"
-                label_to_type = {}
-                for typename, info in rel_def.items():
-                    sl = info["source"]
-                    tl = info["target"]
-                    label_to_type[(sl, tl)] = typename
+                        if typename not in grouped[reltype]:
+                            grouped[reltype][typename] = (array("q"), array("q"), [])
 
-                grouped = {typename: [] for typename in rel_def.keys()}
+                        srcs, dsts, feats = grouped[reltype][typename]
+                        srcs.append(r["src"])
+                        dsts.append(r["dst"])
+                        feats.append(r["props"])
 
-                for src_id, dst_id, props, src_labels, dst_labels in triples:
-                    for sl in src_labels:
-                        for tl in dst_labels:
-                            if (sl, tl) in label_to_type:
-                                typename = label_to_type[(sl, tl)]
-                                grouped[typename].append((src_id, dst_id, props))
+            # label -> {node id: position in nodes_ids[label]}, for as_csr
+            positions = {}
+            if as_csr:
+                positions = {
+                    lab: {node_id: i for i, node_id in enumerate(ids)}
+                    for lab, ids in nodes_ids.items()
+                }
 
-                for typename, items in grouped.items():
-                    if not items:
-                        continue
+            for reltype, groups in grouped.items():
 
-                    srcs = [e[0] for e in items]
-                    dsts = [e[1] for e in items]
-                    feats = [e[2] for e in items]
+                edges_indices[reltype] = {}
+                edges_attributes[reltype] = {}
 
-                    edges_indices[reltype][typename] = np.array([srcs, dsts])
+                for typename, (srcs, dsts, feats) in groups.items():
+                    if as_csr:
+                        info = relationships[reltype][typename]
+                        adjacency, feats = _edge_csr(
+                            srcs,
+                            dsts,
+                            feats,
+                            positions.get(info["source"], {}),
+                            positions.get(info["target"], {}),
+                        )
+                        edges_indices[reltype][typename] = adjacency
+                    else:
+                        edges_indices[reltype][typename] = _edge_index(srcs, dsts)
                     edges_attributes[reltype][typename] = feats
-                    
-            print("Finished extraction of subgraph.")
+
+            logger.info("Finished extraction of subgraph.")
             return nodes_ids, nodes_features, edges_indices, edges_attributes
     
     def run_custom_query(self, query, parameters=None):
-        with self.driver.session(database=self.database) as session:
+        with self._new_session() as session:
             results = session.run(query, parameters)
             data = [result.data() for result in results]
             return data